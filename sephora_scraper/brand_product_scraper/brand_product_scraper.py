@@ -1,19 +1,36 @@
+from __future__ import annotations
+
+import os
 import sys
-import psycopg2.extras
-import psycopg2
 import csv
-import requests
+import glob
+
+from ast import literal_eval
 
-from bs4 import BeautifulSoup
 from multiprocessing.pool import ThreadPool
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-from sql_statements import sql_create_product_table, sql_create_brand_table
-from pydantic_basemodel import BrandInfo, ProductInfo
+from sql_statements import sql_create_product_table, sql_create_brand_table, sql_aggregate_views
+from fetch_planner import FetchPlanner, fingerprint
 from db_config import host, user, password, db_name
 
+# Heavy dependencies (requests, bs4, pydantic, psycopg2) are imported inside the functions
+# that use them, so that short jobs only pay for the imports they actually need
+if TYPE_CHECKING:
+    import requests
+
 
 lst_404, bad_json = [], []
+product_fingerprints = {}  # product ID -> checksum of its brand page entry
+
+# CSV columns stored as lists ('text[]' in PostgreSQL)
+LIST_COLUMNS = ('products', 'ingredients', 'highlights')
+
+# Skip products whose brand page metadata hasn't changed since the last crawl
+SKIP_UNCHANGED = False
+# The maximum number of products fetched per run, the most stale first (None - no limit)
+MAX_PRODUCTS = None
 
 
 def make_request(url: str) -> requests.Response | None:
@@ -25,7 +42,9 @@ def make_request(url: str) -> requests.Response | None:
     Returns:
         Response | None
     """
-    proxy = 'YOUR PROXY'
+    import requests
+
+    proxy = os.environ.get('SEPHORA_PROXY', 'YOUR PROXY')
     proxies = {"https": proxy}
     num_retries = 3
     success_list = [200, 404]
@@ -54,6 +73,8 @@ def get_all_brand_names(resp) -> list[str]:
         2. From 'links' attribute of each element extract brand name
         4. Return the list of brand names
     """
+    from bs4 import BeautifulSoup
+
     print('Extracting all brand names from the site...')
 
     soup = BeautifulSoup(resp.text, 'html.parser')
@@ -83,10 +104,14 @@ def get_brand_info(brand_name: str, brand_resp) -> dict:
            additional pages to retrieve. One brand page contains max 300 products.
         3. If there are additional pages, iterate over each page and retrieve the list of products
         4. Append the list of products from each additional page to the original list of products.
-        5. Return the validated dictionary of brand information
+        5. Store the fingerprint of each product entry for the fetch planner
+        6. Return the validated dictionary of brand information
     """
+    from pydantic_basemodel import BrandInfo
+
     # Transform the first page of the brand response into a validated dictionary using Pydantic model
     brand_info = BrandInfo(**brand_resp.json()).dict()
+    store_fingerprints(brand_resp.json())
 
     # Calculate the number of additional pages to retrieve, based on the number of total products
     total_products = brand_info['total_products']
@@ -102,10 +127,18 @@ def get_brand_info(brand_name: str, brand_resp) -> dict:
             if resp is not None and resp.status_code == 200:
                 cur_page_products = BrandInfo(**resp.json()).products
                 brand_info['products'].extend(cur_page_products)
+                store_fingerprints(resp.json())
     print('processing')
     return brand_info
 
 
+def store_fingerprints(brand_json: dict) -> None:
+    """Stores a fingerprint of each product entry from the raw brand page JSON."""
+    for product in brand_json.get('products') or []:
+        if product.get('productId') is not None:
+            product_fingerprints[product['productId']] = fingerprint(product)
+
+
 def get_product_info(url: str) -> dict | None:
     """Extracts information about a product from JSON response using the Pydantic model
     and returns validated dictionary of product information.
@@ -117,6 +150,8 @@ def get_product_info(url: str) -> dict | None:
         Successful response - a dictionary with processed values,
         Unsuccessful response - 'None'
     """
+    from pydantic_basemodel import ProductInfo
+
     resp = make_request(url)
     if resp is not None and resp.status_code == 200:
         try:
@@ -135,6 +170,7 @@ def get_product_info(url: str) -> dict | None:
 
 def save_to_csv(all_info: list[dict], table_name: str) -> None:
     """Saves the passed information to a CSV file in the 'Output' folder.
+    The file is overwritten, so re-running the scraper doesn't append duplicate rows.
 
     Args:
         all_info: A list of dictionaries, where each dictionary contains
@@ -149,7 +185,7 @@ def save_to_csv(all_info: list[dict], table_name: str) -> None:
     # Write data to the CSV file
     print(f'Saving information to the "{table_name}.csv" file...')
 
-    with open(csv_path, 'a', encoding='utf-8', newline='') as out_file:
+    with open(csv_path, 'w', encoding='utf-8', newline='') as out_file:
         dw = csv.DictWriter(out_file, fieldnames=all_info[0].keys())
         dw.writeheader()
         dw.writerows(all_info)
@@ -157,13 +193,49 @@ def save_to_csv(all_info: list[dict], table_name: str) -> None:
     print(f'Information has been successfully saved to the "{table_name}.csv" file\n')
 
 
+def read_csv(csv_path: Path) -> list[dict]:
+    """Reads a table saved by `save_to_csv()` back into a list of dictionaries.
+    Empty values -> None, list columns "['a', 'b']" -> ['a', 'b'], repeated header rows are skipped.
+    """
+    with open(csv_path, 'r', encoding='utf-8', newline='') as in_file:
+        rows = [row for row in csv.DictReader(in_file) if any(k != v for k, v in row.items())]
+    for row in rows:
+        for key, value in row.items():
+            if value == '':
+                row[key] = None
+            elif key in LIST_COLUMNS:
+                row[key] = literal_eval(value)
+    return rows
+
+
+def read_products_csv(patterns: list[str]) -> list[dict]:
+    """Reads and merges product tables saved by `save_to_csv()`, e.g. the files of all shards.
+
+    Args:
+        patterns: Paths or glob patterns of the CSV files, e.g. ['Output/product_info_*_of_8.csv']
+
+    Returns:
+        list[dict]: Information about each product, the last row is kept for repeated products
+
+    Raises:
+        FileNotFoundError: If no file matches the patterns
+    """
+    csv_paths = sorted({path for pattern in patterns for path in glob.glob(pattern)})
+    if not csv_paths:
+        raise FileNotFoundError(f'No product files match {patterns}')
+    all_products_info = [row for csv_path in csv_paths for row in read_csv(Path(csv_path))]
+    return list({row['product_id']: row for row in all_products_info}.values())
+
+
 def save_to_db(all_info: list[dict], create_table_statement: str, table_name: str) -> None:
     """Saves the passed information to a Postgresql database.
 
     Steps:
         1. Create database connection
-        2. Create table in database with passed table name
-        3. Insert all data in this table
+        2. Create table in database with passed table name if it doesn't exist
+        3. Replace all data in this table in one transaction, so that re-running the scraper
+           keeps the table (and the summary views depending on it) instead of recreating it.
+           TRUNCATE locks the table until the transaction is committed, the views stay readable
         4. Сlose database connection
 
     Args:
@@ -173,15 +245,18 @@ def save_to_db(all_info: list[dict], create_table_statement: str, table_name: st
         table_name: The name of the created table in the database
     """
 
+    import psycopg2
+    import psycopg2.extras
+
     print(f'Saving information to the "{table_name}" table in PostgreSQL...')
 
     # Create connection to the database
     conn = psycopg2.connect(host=host, user=user, password=password, database=db_name)
-    conn.autocommit = True
 
-    with conn.cursor() as cursor:
-        # Create table with SQL statement
+    with conn, conn.cursor() as cursor:
+        # Create table with SQL statement and remove the data of the previous run
         cursor.execute(create_table_statement.format(f'{table_name}'))
+        cursor.execute(f'TRUNCATE {table_name} RESTART IDENTITY')
 
         # Prepare column names for `query` statement
         col_names = ','.join(list(all_info[0].keys()))  # -> 'col_n1,col_n2'
@@ -196,7 +271,55 @@ def save_to_db(all_info: list[dict], create_table_statement: str, table_name: st
     print(f'Information has been successfully saved to the "{table_name}" table in PostgreSQL\n')
 
 
-def main():
+def save_aggregates_to_db(product_table: str) -> None:
+    """Materializes summary tables over the product table in a Postgresql database,
+    so that notebooks and dashboards can read pre-aggregated results instead of
+    rescanning the full product table.
+
+    Created materialized views (named '<product_table>_<suffix>'):
+        - brand_summary: product count, average price, rating, loves and reviews per brand
+        - category_summary: the same per category breadcrumb plus limited edition share
+        - highlights: sparse product x highlight incidence matrix, one row per pair
+        - highlight_summary: product count, average price, rating, loves and reviews per highlight
+
+    Steps:
+        1. Create database connection
+        2. For each view: create it empty if it doesn't exist, then fill it with a plain refresh
+           if it has never been populated, otherwise refresh it concurrently
+        3. Сlose database connection
+
+    Args:
+        product_table: The name of the product table in the database
+    """
+    import psycopg2
+
+    print(f'Materializing summary tables for the "{product_table}" table in PostgreSQL...')
+
+    # Create connection to the database
+    conn = psycopg2.connect(host=host, user=user, password=password, database=db_name)
+    conn.autocommit = True
+
+    with conn.cursor() as cursor:
+        for suffix, statement in sql_aggregate_views.items():
+            view = f'{product_table}_{suffix}'
+            cursor.execute(statement.format(product_table=product_table, view=view))
+
+            cursor.execute('SELECT ispopulated FROM pg_matviews WHERE matviewname = %s', (view,))
+            concurrently = 'CONCURRENTLY ' if cursor.fetchone()[0] else ''
+            cursor.execute(f'REFRESH MATERIALIZED VIEW {concurrently}{view}')
+
+    # Close connection to the database
+    conn.close()
+    print(f'Summary tables have been successfully materialized: '
+          f'{[f"{product_table}_{suffix}" for suffix in sql_aggregate_views]}\n')
+
+
+def scrape_brands() -> list[dict]:
+    """Collects information about all brands from the site.
+
+    Returns:
+        list[dict]: Validated dictionaries with information about each brand
+    """
     # Get all brand names and put them in one list
     try:
         brand_names = get_all_brand_names(make_request('https://www.sephora.com/brands-list'))
@@ -212,34 +335,81 @@ def main():
         if resp is not None and resp.status_code == 200:
             all_brands_info.append(get_brand_info(brand_name, resp))
     print(f'Information about {len(all_brands_info)} brands has been successfully extracted\n')
+    return all_brands_info
 
-    # Save info about all brands to csv file and PostgreSQL
-    save_to_csv(all_brands_info, table_name='brand_info')
-    save_to_db(all_brands_info, sql_create_brand_table, table_name='brand_info')
+
+def scrape_products(all_brands_info: list[dict], planner: FetchPlanner) -> list[dict]:
+    """Collects information about all products listed on the brand pages.
+
+    Steps:
+        1. Deduplicate product IDs of all brands and order them from the most stale with the planner,
+           fetching at most `MAX_PRODUCTS` of them
+        2. Get information about each product concurrently
+        3. Record successfully fetched products in the planner and save its state
+        4. Add information from previous crawls for products that were not fetched
+           (unchanged or over the budget), so the product table stays complete
+
+    Args:
+        all_brands_info: A list of dictionaries with information about brands
+        planner: The fetch planner holding the state of previous crawls
+
+    Returns:
+        list[dict]: Validated dictionaries with information about each product
+    """
+    product_ids = planner.plan(((prod_id, product_fingerprints.get(prod_id))
+                                for brand in all_brands_info
+                                if brand['products'] is not None
+                                for prod_id in brand['products']),
+                               skip_unchanged=SKIP_UNCHANGED,
+                               max_products=MAX_PRODUCTS)
+    print(f'''Planned {len(product_ids)} products to fetch:
+    - Duplicates skipped: {planner.duplicates}
+    - Unchanged since the last crawl skipped: {planner.unchanged}
+    - Deferred to the next runs (over the limit of {MAX_PRODUCTS}): {planner.deferred}\n''')
 
     # Put all product URLs in one generator
     product_base_url = 'https://www.sephora.com/api2/catalog/products/{}?addCurrentSkuToProductChildSkus=true&showContent=true&includeConfigurableSku=true&countryCode=US&removePersonalizedData=true'
-    product_urls = (product_base_url.format(prod_id)
-                    for brand in all_brands_info
-                    if brand['products'] is not None
-                    for prod_id in brand['products'])
+    product_urls = (product_base_url.format(prod_id) for prod_id in product_ids)
 
     # Get inforamtion about each product
     print('Extracting information about products...')
     with ThreadPool(10) as pool:
-        all_products_info = list(filter(None, pool.map(get_product_info, product_urls)))
+        all_products_info = pool.map(get_product_info, product_urls)
+
+    # Remember successfully fetched products for the next crawl
+    for prod_id, product_info in zip(product_ids, all_products_info):
+        if product_info is not None:
+            planner.mark_fetched(prod_id, product_fingerprints.get(prod_id), product_info)
+    planner.save()
+    previous_products_info = planner.previous_products()
 
     print(f'''Extracting product information was completed successfully.
     Details about the extraction process:
     - 404 Errors: {len(lst_404)}
       Product IDs: {lst_404}
     - Bad JSON or requiring repeated requests: {len(bad_json)}
-      Product IDs: {bad_json}\n''')
+      Product IDs: {bad_json}
+    - Reused from previous crawls: {len(previous_products_info)}
+    - Not fetched yet and missing from the output: {len(planner.not_fetched) - len(previous_products_info)}\n''')
+    return list(filter(None, all_products_info)) + previous_products_info
+
+
+def main():
+    all_brands_info = scrape_brands()
+
+    # Save info about all brands to csv file and PostgreSQL
+    save_to_csv(all_brands_info, table_name='brand_info')
+    save_to_db(all_brands_info, sql_create_brand_table, table_name='brand_info')
+
+    # Get info about all products, fetching each product only once
+    planner = FetchPlanner(Path.cwd() / 'Output' / 'crawl_state.json')
+    all_products_info = scrape_products(all_brands_info, planner)
 
     # Save info about all products to csv file and PostgreSQL
     save_to_csv(all_products_info, table_name='product_info')
     save_to_db(all_products_info, sql_create_product_table, table_name='product_info')
+    save_aggregates_to_db(product_table='product_info')
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,4 +1,7 @@
-host = '127.0.0.1'
-user = 'postgres'
-password = 'YOUR PASSWORD'
-db_name = 'YOUR DATABASE NAME'
\ No newline at end of file
+import os
+
+# Connection parameters can be overridden with environment variables (or a config file passed to `cli.py`)
+host = os.environ.get('SEPHORA_DB_HOST', '127.0.0.1')
+user = os.environ.get('SEPHORA_DB_USER', 'postgres')
+password = os.environ.get('SEPHORA_DB_PASSWORD', 'YOUR PASSWORD')
+db_name = os.environ.get('SEPHORA_DB_NAME', 'YOUR DATABASE NAME')
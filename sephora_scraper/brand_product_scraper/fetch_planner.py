@@ -0,0 +1,179 @@
+import json
+import os
+import re
+import time
+import zlib
+
+from pathlib import Path
+from typing import Iterable
+
+
+def fingerprint(brand_page_product: dict) -> int:
+    """Returns a checksum of the product entry from the brand page JSON response.
+    It changes whenever any metadata shown on the brand page (price, rating, reviews, etc.) changes.
+    """
+    return zlib.crc32(json.dumps(brand_page_product, sort_keys=True).encode('utf-8'))
+
+
+class ProductIdSet:
+    """Compact set of product IDs.
+
+    Regular IDs ('P399755') are stored as bits of a bitmap indexed by their number,
+    so one million IDs take 125 KB instead of tens of MB for a set of strings.
+    Any other IDs are kept in a regular set.
+    """
+    ID_PATTERN = re.compile(r'P(\d{1,7})')
+
+    def __init__(self):
+        self._bitmap = bytearray()
+        self._other: set[str] = set()
+
+    def _bit(self, product_id: str) -> tuple[int, int] | None:
+        """Returns (byte, bit) position of a regular ID in the bitmap, None for any other ID."""
+        match = self.ID_PATTERN.fullmatch(product_id)
+        if match is None or match.group(1).startswith('0'):
+            return None
+        return divmod(int(match.group(1)), 8)
+
+    def __contains__(self, product_id: str) -> bool:
+        position = self._bit(product_id)
+        if position is None:
+            return product_id in self._other
+        byte, bit = position
+        return byte < len(self._bitmap) and bool(self._bitmap[byte] >> bit & 1)
+
+    def add(self, product_id: str) -> bool:
+        """Adds the ID to the set. Returns False if it was already there."""
+        if product_id in self:
+            return False
+        position = self._bit(product_id)
+        if position is None:
+            self._other.add(product_id)
+            return True
+
+        byte, bit = position
+        if byte >= len(self._bitmap):
+            self._bitmap.extend(bytes(byte - len(self._bitmap) + 1))
+        self._bitmap[byte] |= 1 << bit
+        return True
+
+
+class FetchPlanner:
+    """Decides which products to fetch and in what order, based on the state of previous crawls.
+
+    The state is kept in a JSON file:
+        {product_id: [last fetch time (unix seconds), brand page fingerprint, product information]}
+    The saved product information is reused for products that are not fetched in this run
+    (unchanged since the last crawl or over the fetch budget), so the output stays complete.
+
+    Sharded jobs write their own state files, but read the state of every other file passed in
+    `read_paths` too (the newest fetch of each product wins). So a product keeps its history
+    when the shard count changes and it moves to another shard.
+
+    Usage::
+        planner = FetchPlanner(Path.cwd() / 'Output' / 'crawl_state.json')
+        product_ids = planner.plan(brand_products, skip_unchanged=True, max_products=1000)
+        ...  # fetch products
+        planner.mark_fetched(product_id, product_fingerprint, product_info)
+        all_products_info = fetched_products_info + planner.previous_products()
+        planner.save()
+    """
+
+    def __init__(self, state_path: Path, read_paths: Iterable[Path] = ()):
+        self.state_path = state_path
+        self.state: dict[str, list] = {}
+        for path in {state_path, *read_paths}:
+            for product_id, last_fetch in self._read_state(path).items():
+                if product_id not in self.state or self.state[product_id][0] < last_fetch[0]:
+                    self.state[product_id] = last_fetch
+        self.listed: ProductIdSet | None = None  # all products passed to the last plan
+        self.duplicates = 0
+        self.unchanged = 0
+        self.deferred = 0
+        self.not_fetched: list[str] = []  # unchanged and deferred product IDs
+
+    @staticmethod
+    def _read_state(path: Path) -> dict[str, list]:
+        """Reads one state file, an unreadable file is treated as empty."""
+        if not path.exists():
+            return {}
+        try:
+            with open(path, 'r', encoding='utf-8') as in_file:
+                return json.load(in_file)
+        except (OSError, ValueError) as e:
+            print(f'Warning: the crawl state "{path}" could not be read and is ignored, '
+                  f'its products are treated as never fetched: {type(e).__name__} - {e}\n')
+            return {}
+
+    def _previous_info(self, product_id: str) -> dict | None:
+        """Returns the product information saved during the last crawl, None if there is none."""
+        last_fetch = self.state.get(product_id)
+        return last_fetch[2] if last_fetch is not None and len(last_fetch) > 2 else None
+
+    def plan(self,
+             brand_products: Iterable[tuple[str, int | None]],
+             skip_unchanged: bool = False,
+             max_products: int | None = None) -> list[str]:
+        """Returns deduplicated product IDs ordered from the most stale to the most recently fetched.
+
+        Steps:
+            1. Skip IDs that have already been seen (products listed under several brands or pages)
+            2. If `skip_unchanged`, skip products whose brand page fingerprint is the same as
+               during the last crawl and whose information from that crawl is saved
+            3. Put products that have never been fetched first, then the rest by the time of
+               the last fetch, oldest first
+            4. If `max_products` is set, defer the most recently fetched products over this budget
+               to the next runs
+
+        Args:
+            brand_products: Pairs of (product ID, brand page fingerprint or None) from all brands
+            skip_unchanged: Skip products whose brand page metadata hasn't changed
+            max_products: The maximum number of products to fetch in this run, None for no limit
+        """
+        seen = self.listed = ProductIdSet()
+        planned = []
+        for product_id, product_fingerprint in brand_products:
+            if product_id is None:
+                continue
+            if not seen.add(product_id):
+                self.duplicates += 1
+                continue
+            last_fetch = self.state.get(product_id)
+            if (skip_unchanged and self._previous_info(product_id) is not None
+                    and product_fingerprint is not None and last_fetch[1] == product_fingerprint):
+                self.unchanged += 1
+                self.not_fetched.append(product_id)
+                continue
+            planned.append(product_id)
+
+        # sort is stable, so products are fetched in brand order among equally stale ones
+        planned.sort(key=lambda product_id: self.state.get(product_id, [0])[0])
+        if max_products is not None and len(planned) > max_products:
+            self.deferred = len(planned) - max_products
+            self.not_fetched.extend(planned[max_products:])
+            planned = planned[:max_products]
+        return planned
+
+    def previous_products(self) -> list[dict]:
+        """Returns the information saved during previous crawls for products that are not fetched
+        in this run. Deferred products that have never been fetched are missing from it.
+        """
+        return list(filter(None, map(self._previous_info, self.not_fetched)))
+
+    def mark_fetched(self, product_id: str, product_fingerprint: int | None, product_info: dict) -> None:
+        """Records that the product has been fetched successfully."""
+        self.state[product_id] = [int(time.time()), product_fingerprint, product_info]
+
+    def save(self) -> None:
+        """Saves the crawl state of the products passed to `plan()` (all products if it wasn't called)
+        to the JSON file. The state is written to a temporary file first, which then replaces
+        the old one, so an interrupted write never leaves a truncated state.
+        """
+        state = (self.state if self.listed is None
+                 else {product_id: last_fetch for product_id, last_fetch in self.state.items()
+                       if product_id in self.listed})
+        self.state_path.parent.mkdir(exist_ok=True)
+        tmp_path = self.state_path.with_name(f'{self.state_path.name}.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as out_file:
+            json.dump(state, out_file)
+        os.replace(tmp_path, self.state_path)
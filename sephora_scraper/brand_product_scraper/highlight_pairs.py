@@ -0,0 +1,157 @@
+import argparse
+import heapq
+import math
+import sys
+
+from collections import Counter
+from itertools import combinations
+from multiprocessing import Pool
+
+from brand_product_scraper import read_products_csv
+from db_config import host, user, password, db_name
+
+
+def count_cooccurrence(chunk: list[list[str] | None]) -> tuple[Counter, Counter, int]:
+    """Counts highlight frequencies and pairwise co-occurrences in one block of products.
+
+    Only the non-zero cells of the product x highlight incidence matrix are visited:
+    each product contributes the pairs of its own highlights, so the cost depends on
+    the number of highlights per product, not on the size of the highlight vocabulary.
+
+    Args:
+        chunk: A list of highlight lists, one per product (None if the product has no highlights)
+
+    Returns:
+        tuple: (highlight counts, pair counts keyed by sorted highlight tuples, number of products)
+    """
+    tag_counts, pair_counts = Counter(), Counter()
+    for highlights in chunk:
+        tags = sorted(set(highlights or ()))
+        tag_counts.update(tags)
+        pair_counts.update(combinations(tags, 2))
+    return tag_counts, pair_counts, len(chunk)
+
+
+def phi(n11: int, n1: int, n2: int, n: int) -> float:
+    """Phi coefficient (Pearson correlation of two binary variables) from a 2x2 contingency table."""
+    denominator = math.sqrt(n1 * n2 * (n - n1) * (n - n2))
+    return (n * n11 - n1 * n2) / denominator if denominator else 0.0
+
+
+def jaccard(n11: int, n1: int, n2: int, n: int) -> float:
+    """Share of products with either highlight that have both of them."""
+    return n11 / (n1 + n2 - n11)
+
+
+def lift(n11: int, n1: int, n2: int, n: int) -> float:
+    """How many times more often two highlights occur together than if they were independent."""
+    return n * n11 / (n1 * n2)
+
+
+SCORES = {'phi': phi, 'jaccard': jaccard, 'lift': lift}
+
+
+def top_highlight_pairs(all_highlights: list[list[str] | None],
+                        k: int = 20,
+                        score: str = 'phi',
+                        chunk_size: int = 5000,
+                        processes: int = 4) -> list[tuple[str, str, int, float]]:
+    """Returns the top-k associated highlight pairs without building the dense N x N matrix.
+
+    Steps:
+        1. Split products into blocks of `chunk_size` and count highlight frequencies
+           and co-occurrences of each block in a separate process
+        2. Merge the counts of all blocks
+        3. Score only pairs that occur together at least once (the others can't be
+           positively associated) and keep the top-k with a heap
+
+    Args:
+        all_highlights: A list of highlight lists, one per product
+        k: The number of pairs to return
+        score: Association score - 'phi', 'jaccard' or 'lift'
+        chunk_size: The number of products counted by one worker at a time
+        processes: The number of worker processes, 1 to count in the current process
+
+    Returns:
+        list[tuple]: (highlight_1, highlight_2, co-occurrence count, score) sorted by score descending
+    """
+    score_func = SCORES[score]
+    chunks = [all_highlights[i:i + chunk_size] for i in range(0, len(all_highlights), chunk_size)]
+
+    if processes > 1 and len(chunks) > 1:
+        with Pool(processes) as pool:
+            block_counts = pool.map(count_cooccurrence, chunks)
+    else:
+        block_counts = map(count_cooccurrence, chunks)
+
+    # Merge the counts of all blocks
+    tag_counts, pair_counts, n = Counter(), Counter(), 0
+    for block_tags, block_pairs, block_n in block_counts:
+        tag_counts.update(block_tags)
+        pair_counts.update(block_pairs)
+        n += block_n
+
+    scored_pairs = ((a, b, n11, score_func(n11, tag_counts[a], tag_counts[b], n))
+                    for (a, b), n11 in pair_counts.items())
+    return heapq.nlargest(k, scored_pairs, key=lambda pair: pair[3])
+
+
+def read_highlights_csv(patterns: list[str]) -> list[list[str] | None]:
+    """Reads the 'highlights' column of the product tables saved by `save_to_csv()`.
+
+    Args:
+        patterns: Paths or glob patterns of the product CSV files, e.g. the files of all shards
+
+    Returns:
+        list: Highlight lists, one per product, transforms "['Vegan', 'Oil Free']" -> ['Vegan', 'Oil Free']
+    """
+    return [product['highlights'] for product in read_products_csv(patterns)]
+
+
+def read_highlights_db(product_table: str = 'product_info') -> list[list[str] | None]:
+    """Reads highlights from the sparse incidence view '<product_table>_highlights' materialized
+    by `save_aggregates_to_db()`. Products without highlights are not in the view,
+    so they are added as None to keep the total number of products for the scores.
+
+    Args:
+        product_table: The name of the product table in the database
+
+    Returns:
+        list: Highlight lists, one per product
+    """
+    import psycopg2
+
+    conn = psycopg2.connect(host=host, user=user, password=password, database=db_name)
+    with conn, conn.cursor() as cursor:
+        cursor.execute(f'SELECT count(*) FROM {product_table}')
+        total_products = cursor.fetchone()[0]
+        cursor.execute(f'SELECT array_agg(highlight) FROM {product_table}_highlights GROUP BY product_id_db')
+        all_highlights = [highlights for (highlights,) in cursor.fetchall()]
+    conn.close()
+    return all_highlights + [None] * (total_products - len(all_highlights))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Top associated highlight (tag) pairs')
+    parser.add_argument('csv', nargs='*', default=['Output/product_info*.csv'],
+                        help='product CSV files or glob patterns (default: Output/product_info*.csv)')
+    parser.add_argument('--db', metavar='TABLE', nargs='?', const='product_info',
+                        help='read highlights from the TABLE_highlights view in PostgreSQL instead of CSV '
+                             '(default TABLE: product_info)')
+    parser.add_argument('-k', type=int, default=20, help='number of pairs to show (default: 20)')
+    parser.add_argument('--score', choices=SCORES, default='phi', help='association score (default: phi)')
+    args = parser.parse_args()
+
+    source = f'"{args.db}_highlights" view' if args.db else args.csv
+    try:
+        all_highlights = read_highlights_db(args.db) if args.db else read_highlights_csv(args.csv)
+    except Exception as e:
+        sys.exit(f'An error occurred while trying to read {source}: {type(e).__name__} - {e}')
+
+    print(f'Top {args.k}: What tags go together frequently? ({len(all_highlights)} products)')
+    for a, b, n11, value in top_highlight_pairs(all_highlights, k=args.k, score=args.score):
+        print(f'{a} | {b}: {value:.3f} ({n11} products)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+import argparse
+import random
+import re
+import sys
+import zlib
+
+from collections import defaultdict
+from itertools import combinations
+
+from brand_product_scraper import read_products_csv
+
+
+# Different names of the same ingredient -> one name used in the index
+INGREDIENT_ALIASES = {
+    'aqua': 'water',
+    'eau': 'water',
+    'parfum': 'fragrance',
+    'perfume': 'fragrance',
+    'aroma': 'fragrance',
+    'flavor': 'fragrance',
+}
+
+# Names that are folded into one when listed as alternatives, e.g. 'Water/Aqua/Eau' -> 'water'
+KNOWN_SYNONYMS = set(INGREDIENT_ALIASES) | set(INGREDIENT_ALIASES.values())
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+
+def normalize_ingredients(ingredients: list[str] | None) -> set[str]:
+    """Splits the cleaned ingredient lists of a product into a set of normalized ingredient names.
+        input (list[str]):
+            ['Product variation 1:', 'Ingredients: Parfum (Fragrance), Water/Aqua/Eau, Niacinamide 5%*, 1,2-Hexanediol.']
+        output (set[str]):
+            {'fragrance', 'water', 'niacinamide', '1,2-hexanediol'}
+    Steps:
+        1. Skip variation headers (elements ending with ':').
+        2. Split each element by commas that are not inside parentheses or between digits.
+        3. Lowercase the name, drop a leading label ('Ingredients:'), concentrations ('5%'),
+           parenthesized parts and extraneous characters ('*', '.', etc.).
+        4. Replace known aliases with one name (e.g. 'aqua' -> 'water'). Slash-separated names
+           are folded only if they list a known alias ('Water/Aqua/Eau' -> 'water'), other names
+           keep the slash ('Caprylic/Capric Triglyceride').
+    """
+    names = set()
+    for element in ingredients or ():
+        if element.strip().endswith(':'):
+            continue
+        for name in re.split(r',(?![^(]*\))(?!\d)', element):
+            name = re.sub(r'\(.*?\)|\[.*?\]|\d+([.,]\d+)?\s*%', '', name.lower())
+            name = re.sub(r'^[^:]*:', '', name)
+            name = re.sub(r'\s+', ' ', name.strip(' *.;†'))
+            synonyms = [part.strip() for part in name.split('/') if part.strip() in KNOWN_SYNONYMS]
+            if synonyms:
+                name = synonyms[0]
+            if name:
+                names.add(INGREDIENT_ALIASES.get(name, name))
+    return names
+
+
+def encode_varint(number: int) -> bytes:
+    """Encodes a non-negative integer into 7-bit groups, the high bit marks that more bytes follow."""
+    out = bytearray()
+    while number >= 0x80:
+        out.append(number & 0x7F | 0x80)
+        number >>= 7
+    out.append(number)
+    return bytes(out)
+
+
+def decode_postings(data: bytes) -> list[int]:
+    """Decodes a delta + varint compressed posting list back into sorted document numbers."""
+    postings, number, shift, last = [], 0, 0, 0
+    for byte in data:
+        number |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            last += number
+            postings.append(last)
+            number, shift = 0, 0
+    return postings
+
+
+class IngredientIndex:
+    """Inverted index over product ingredients: ingredient -> compressed posting list of products.
+
+    Products get sequential document numbers in the order they are added, so each posting
+    list is stored as gaps between sorted document numbers encoded with varints.
+    Each product also gets a MinHash signature of its ingredient set for near-duplicate search.
+
+    Usage::
+        index = IngredientIndex()
+        for product in all_products_info:
+            index.add(product['product_id'], product['brand_name'], product['ingredients'])
+        index.search(include=['niacinamide'], exclude=['fragrance'])
+        index.near_duplicates(threshold=0.9)
+    """
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        self.product_ids: list[str] = []
+        self.brands: list[str | None] = []
+        self.signatures: list[tuple[int, ...]] = []
+        self._doc_by_product: dict[str, int] = {}
+        self._postings: dict[str, bytearray] = defaultdict(bytearray)
+        self._last_doc: dict[str, int] = {}
+
+        # Hash functions of the form (a * x + b) mod p, one per MinHash permutation
+        rnd = random.Random(seed)
+        self.num_perm = num_perm
+        self._hash_params = [(rnd.randrange(1, MERSENNE_PRIME), rnd.randrange(0, MERSENNE_PRIME))
+                             for _ in range(num_perm)]
+
+    def __len__(self) -> int:
+        return len(self.product_ids)
+
+    def add(self, product_id: str, brand_name: str | None, ingredients: list[str] | None) -> None:
+        """Adds a product to the index. Products already in the index are skipped.
+
+        Args:
+            product_id: The unique identifier for the product from the site
+            brand_name: The full name of the product brand
+            ingredients: A list of cleaned ingredients from `CurrentSku.clean_ingredients`
+        """
+        if product_id in self._doc_by_product:
+            return
+        doc = len(self.product_ids)
+        self._doc_by_product[product_id] = doc
+        self.product_ids.append(product_id)
+        self.brands.append(brand_name)
+
+        names = normalize_ingredients(ingredients)
+        for name in names:
+            self._postings[name] += encode_varint(doc - self._last_doc.get(name, 0))
+            self._last_doc[name] = doc
+        self.signatures.append(self._minhash(names))
+
+    def postings(self, ingredient: str) -> list[int]:
+        """Returns sorted document numbers of all products containing the ingredient."""
+        name = next(iter(normalize_ingredients([ingredient])), '')
+        return decode_postings(self._postings.get(name, b''))
+
+    def search(self, include: list[str], exclude: list[str] | None = None) -> list[str]:
+        """Returns IDs of products that contain all `include` ingredients and none of `exclude`.
+
+        Steps:
+            1. Decode posting lists of the included ingredients, starting with the shortest one
+            2. Intersect them, stopping early if the result becomes empty
+            3. Remove products from the posting lists of the excluded ingredients
+        """
+        include_postings = sorted((self.postings(name) for name in include), key=len)
+        if not include_postings:
+            return []
+        docs = set(include_postings[0])
+        for postings in include_postings[1:]:
+            if not docs:
+                break
+            docs.intersection_update(postings)
+        for name in exclude or ():
+            docs.difference_update(self.postings(name))
+        return [self.product_ids[doc] for doc in sorted(docs)]
+
+    def _minhash(self, names: set[str]) -> tuple[int, ...]:
+        """Calculates the MinHash signature of an ingredient set (empty tuple for an empty set)."""
+        if not names:
+            return ()
+        hashes = [zlib.crc32(name.encode('utf-8')) for name in names]
+        return tuple(min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in self._hash_params)
+
+    def near_duplicates(self,
+                        threshold: float = 0.9,
+                        bands: int = 16,
+                        cross_brand_only: bool = True) -> list[tuple[str, str, float]]:
+        """Finds pairs of products with nearly identical formulas using MinHash with LSH banding.
+
+        Steps:
+            1. Split each signature into `bands` bands and group products with an identical band
+            2. Compare signatures only for products that share at least one band
+            3. Keep pairs whose estimated Jaccard similarity of ingredients is at least `threshold`
+
+        Args:
+            threshold: Minimum estimated Jaccard similarity of the ingredient sets
+            bands: The number of LSH bands, must divide `num_perm`. More bands find more
+                candidates with lower similarity at the cost of more comparisons
+            cross_brand_only: Keep only pairs of products from different brands
+
+        Returns:
+            list[tuple]: (product_id_1, product_id_2, estimated similarity) sorted by similarity descending
+
+        Raises:
+            ValueError: If `bands` doesn't divide `num_perm`
+        """
+        if self.num_perm % bands != 0:
+            raise ValueError(f'The number of bands ({bands}) must divide num_perm ({self.num_perm})')
+        rows = self.num_perm // bands
+        buckets = defaultdict(list)
+        for doc, signature in enumerate(self.signatures):
+            if signature:
+                for band in range(bands):
+                    buckets[(band, signature[band * rows:(band + 1) * rows])].append(doc)
+
+        candidates = {pair for docs in buckets.values() for pair in combinations(docs, 2)}
+
+        pairs = []
+        for doc_1, doc_2 in candidates:
+            if cross_brand_only and self.brands[doc_1] == self.brands[doc_2]:
+                continue
+            sig_1, sig_2 = self.signatures[doc_1], self.signatures[doc_2]
+            similarity = sum(h_1 == h_2 for h_1, h_2 in zip(sig_1, sig_2)) / self.num_perm
+            if similarity >= threshold:
+                pairs.append((self.product_ids[doc_1], self.product_ids[doc_2], similarity))
+        return sorted(pairs, key=lambda pair: pair[2], reverse=True)
+
+
+def index_products_csv(patterns: list[str]) -> IngredientIndex:
+    """Builds the ingredient index from the product tables saved by `save_to_csv()`.
+
+    Args:
+        patterns: Paths or glob patterns of the product CSV files, e.g. the files of all shards
+    """
+    index = IngredientIndex()
+    for product in read_products_csv(patterns):
+        index.add(product['product_id'], product['brand_name'], product['ingredients'])
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingredient search and near-duplicate formulas')
+    parser.add_argument('csv', nargs='*', default=['Output/product_info*.csv'],
+                        help='product CSV files or glob patterns (default: Output/product_info*.csv)')
+    parser.add_argument('--include', nargs='+', default=['niacinamide'], metavar='INGREDIENT',
+                        help='ingredients the products must contain (default: niacinamide)')
+    parser.add_argument('--exclude', nargs='*', default=['fragrance'], metavar='INGREDIENT',
+                        help='ingredients the products must not contain (default: fragrance)')
+    parser.add_argument('--threshold', type=float, default=0.9,
+                        help='minimum similarity of near-duplicate formulas (default: 0.9)')
+    args = parser.parse_args()
+
+    try:
+        index = index_products_csv(args.csv)
+    except Exception as e:
+        sys.exit(f'An error occurred while trying to read {args.csv}: {type(e).__name__} - {e}')
+    print(f'{len(index)} products have been indexed\n')
+
+    found = index.search(include=args.include, exclude=args.exclude)
+    print(f'Products with {args.include} but without {args.exclude}: {len(found)}. '
+          f'Here are the first five: {found[:5]}\n')
+
+    duplicates = index.near_duplicates(threshold=args.threshold)
+    print(f'Near-duplicate formulas across brands: {len(duplicates)}. Here are the first five: {duplicates[:5]}')
+
+
+if __name__ == '__main__':
+    main()
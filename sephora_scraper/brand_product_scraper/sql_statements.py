@@ -1,5 +1,5 @@
 sql_create_product_table = """
-CREATE TABLE {}(
+CREATE TABLE IF NOT EXISTS {}(
     product_id_db serial PRIMARY KEY,
     product_id text,
     product_name text,
@@ -31,10 +31,87 @@ CREATE TABLE {}(
 """
 
 sql_create_brand_table = """
-CREATE TABLE {}(
+CREATE TABLE IF NOT EXISTS {}(
     brand_id_db serial PRIMARY KEY,
     brand_id int,
     brand_name text,
     products text[],
     total_products int);
-"""
\ No newline at end of file
+"""
+
+# Summary tables materialized over the product table after it has been saved.
+# Each statement creates the view empty (`WITH NO DATA`) if it doesn't exist and adds
+# the unique index required for `REFRESH ... CONCURRENTLY`. The views are filled by
+# `save_aggregates_to_db()`: with a plain refresh the first time, concurrently afterwards,
+# so re-running the scraper keeps them up to date without blocking readers. A concurrent
+# refresh still recomputes the whole aggregate and only applies the difference to the view.
+# Placeholders: {product_table} - source table, {view} - name of the created view
+
+sql_brand_summary_view = """
+CREATE MATERIALIZED VIEW IF NOT EXISTS {view} AS
+    SELECT brand_id,
+           brand_name,
+           count(*) AS total_products,
+           round(avg(price_usd), 2) AS avg_price_usd,
+           round(avg(rating), 2) AS avg_rating,
+           round(avg(loves_count), 2) AS avg_loves_count,
+           round(avg(reviews), 2) AS avg_reviews,
+           sum(limited_edition) AS limited_edition
+    FROM {product_table}
+    GROUP BY brand_id, brand_name
+    WITH NO DATA;
+CREATE UNIQUE INDEX IF NOT EXISTS {view}_idx ON {view} (brand_id, brand_name);
+"""
+
+sql_category_summary_view = """
+CREATE MATERIALIZED VIEW IF NOT EXISTS {view} AS
+    SELECT primary_category,
+           secondary_category,
+           tertiary_category,
+           count(*) AS total_products,
+           round(avg(price_usd), 2) AS avg_price_usd,
+           round(avg(rating), 2) AS avg_rating,
+           round(avg(loves_count), 2) AS avg_loves_count,
+           round(avg(reviews), 2) AS avg_reviews,
+           sum(limited_edition) AS limited_edition,
+           round(100.0 * sum(limited_edition) / nullif(sum(sum(limited_edition)) OVER (), 0), 2)
+               AS limited_edition_share
+    FROM {product_table}
+    GROUP BY primary_category, secondary_category, tertiary_category
+    WITH NO DATA;
+CREATE UNIQUE INDEX IF NOT EXISTS {view}_idx ON {view} (primary_category, secondary_category, tertiary_category);
+"""
+
+# Sparse product x highlight incidence matrix: one row per non-zero cell
+sql_product_highlight_view = """
+CREATE MATERIALIZED VIEW IF NOT EXISTS {view} AS
+    SELECT DISTINCT product_id_db, product_id, unnest(highlights) AS highlight
+    FROM {product_table}
+    WHERE highlights IS NOT NULL
+    WITH NO DATA;
+CREATE UNIQUE INDEX IF NOT EXISTS {view}_idx ON {view} (product_id_db, highlight);
+CREATE INDEX IF NOT EXISTS {view}_highlight_idx ON {view} (highlight);
+"""
+
+sql_highlight_summary_view = """
+CREATE MATERIALIZED VIEW IF NOT EXISTS {view} AS
+    SELECT h.highlight,
+           count(*) AS total_products,
+           round(avg(p.price_usd), 2) AS avg_price_usd,
+           round(avg(p.rating), 2) AS avg_rating,
+           round(avg(p.loves_count), 2) AS avg_loves_count,
+           round(avg(p.reviews), 2) AS avg_reviews
+    FROM {product_table}_highlights h
+    JOIN {product_table} p USING (product_id_db)
+    GROUP BY h.highlight
+    WITH NO DATA;
+CREATE UNIQUE INDEX IF NOT EXISTS {view}_idx ON {view} (highlight);
+"""
+
+# Views in the order they have to be refreshed, with the suffix appended to the product table name
+sql_aggregate_views = {
+    'brand_summary': sql_brand_summary_view,
+    'category_summary': sql_category_summary_view,
+    'highlights': sql_product_highlight_view,
+    'highlight_summary': sql_highlight_summary_view,
+}
@@ -1,12 +1,16 @@
+from __future__ import annotations
+
+import os
 import csv
-import json
 import math
-import requests
 
-from math import ceil
 from pathlib import Path
 from multiprocessing.pool import ThreadPool
-from pydantic_bazzar import ReviewInfo
+from typing import TYPE_CHECKING
+
+# Heavy dependencies (requests, pydantic) are imported inside the functions that use them
+if TYPE_CHECKING:
+    import requests
 
 
 base_url = 'https://api.bazaarvoice.com/data/reviews.json?Filter=ProductId:{}&Limit=100&Offset={}&Include=Products,Comments&Stats=Reviews&passkey=calXm2DyQVjcCy9agq85vmTJv5ELuuBCF2sdg4BnJzJus&apiversion=5.4'
@@ -21,8 +25,9 @@ def make_request(url: str) -> requests.Response | None:
     Returns:
         Response | None
     """
+    import requests
 
-    proxy = 'YOUR PROXY'
+    proxy = os.environ.get('SEPHORA_PROXY', 'YOUR PROXY')
     proxies = {"https": proxy}
     num_retries = 3
     success_list = [200, 404]
@@ -48,6 +53,7 @@ def get_first_page_reviews(product_id: str) -> list[dict] | None:
          Success response - List of dictionaries, each dictionary contains 17 keys.
          Unsuccessful response - None.
     """
+    from pydantic_basemodel import ReviewInfo
 
     # With 'format' function in base url change 'Filter=ProductId:{}' and 'Offset={}' parameters
     first_page_resp = make_request(base_url.format(f'{product_id}', 0))
@@ -84,6 +90,7 @@ def get_remaining_reviews(page_url: str) -> list[dict] | None:
          Success response - List of dictionaries, each dictionary contains 17 keys.
          Unsuccessful response - None.
     """
+    from pydantic_basemodel import ReviewInfo
 
     page_resp = make_request(page_url)
 
@@ -106,6 +113,8 @@ def get_remaining_reviews(page_url: str) -> list[dict] | None:
 
 def save_to_csv(all_info: list, table_name: str, first_page_reviews=True) -> None:
     """Saves reviews data to a CSV file in the 'Output' folder.
+    Reviews from the first pages replace the file (an empty file if there are none),
+    reviews from the remaining pages are appended to it.
 
     Args:
         all_info: A list containing dictionaries with reviews data
@@ -124,33 +133,44 @@ def save_to_csv(all_info: list, table_name: str, first_page_reviews=True) -> Non
     # Write data to the CSV file
     print(f'Saving information to the "{table_name}.csv" file...')
 
-    with open(csv_path, 'a', encoding='utf-8', newline='') as out_file:
-        dw = csv.DictWriter(out_file, fieldnames=all_info[0].keys())
-        if first_page_reviews:
-            dw.writeheader()
-        dw.writerows(all_info)
+    with open(csv_path, 'w' if first_page_reviews else 'a', encoding='utf-8', newline='') as out_file:
+        if all_info:
+            dw = csv.DictWriter(out_file, fieldnames=all_info[0].keys())
+            if first_page_reviews:
+                dw.writeheader()
+            dw.writerows(all_info)
 
     print(f'Information has been successfully saved to the "{table_name}.csv" file\n')
 
 
-def main():
-    # Upload a file of product IDs in one list
-    print('Opening input file...')
-    with open('product_ids.txt', 'r', encoding='utf-8') as f:
-        product_ids = f.read().splitlines()
+def scrape_reviews(product_ids: list[str], table_name: str = 'product_reviews') -> None:
+    """Collects all reviews for the passed products and saves them to a CSV file.
 
+    Args:
+        product_ids: A list of product IDs to retrieve reviews for
+        table_name: The name of the CSV file to be created
+    """
     # Get reviews from the first page of each product and save them in CSV
     print(f'Processing {len(product_ids)} first pages...')
     with ThreadPool(10) as pool:
         all_reviews = list(filter(None, pool.map(get_first_page_reviews, product_ids)))
-    save_to_csv(all_reviews, 'product_reviews')
+    save_to_csv(all_reviews, table_name)
 
     # If the remaining pages exist, get reviews from them and add to the already created CSV
     if remaining_product_urls:
         print(f'Processing {len(remaining_product_urls)} remaining pages...')
         with ThreadPool(10) as pool:
             all_reviews = list(filter(None, pool.map(get_remaining_reviews, remaining_product_urls)))
-        save_to_csv(all_reviews, 'product_reviews', first_page_reviews=False)
+        save_to_csv(all_reviews, table_name, first_page_reviews=False)
+
+
+def main():
+    # Upload a file of product IDs in one list
+    print('Opening input file...')
+    with open('product_ids.txt', 'r', encoding='utf-8') as f:
+        product_ids = f.read().splitlines()
+
+    scrape_reviews(product_ids)
 
 
 if __name__ == '__main__':